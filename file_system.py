@@ -5,7 +5,9 @@
 import abc
 import dataclasses
 import enum
-from typing import Callable, Iterable
+import posixpath
+import sys
+from typing import Callable, Iterable, List, Optional, Tuple
 
 
 class FileSystemEventType(enum.Enum):
@@ -16,7 +18,19 @@ class FileSystemEventType(enum.Enum):
     FILE_MODIFIED = 3
 
 
-@dataclasses.dataclass
+class FileSystemObjType(enum.Enum):
+    """Types of objects stored in the file system."""
+
+    FILE = 1
+    DIRECTORY = 2
+
+
+# dataclass slots are only supported from Python 3.10; older versions fall back
+# to regular dataclasses with an instance __dict__.
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclasses.dataclass(frozen=True, **_DATACLASS_SLOTS)
 class FileSystemEvent:
     """File system events."""
 
@@ -31,6 +45,14 @@ class FileSystem(abc.ABC):
     def exists(self, path: str) -> bool:
         """Returns whether the path exists."""
 
+    def stat(self, path: str) -> Optional[FileSystemObjType]:
+        """Returns the type of the object at the path, or None if it does not exist."""
+        if not self.exists(path):
+            return None
+        if self.isdir(path):
+            return FileSystemObjType.DIRECTORY
+        return FileSystemObjType.FILE
+
     @abc.abstractmethod
     def isfile(self, path: str) -> bool:
         """Returns whether the path is a file."""
@@ -61,6 +83,16 @@ class FileSystem(abc.ABC):
         Note that the returned names are the base names, not the full paths.
         """
 
+    def listdir_types(self, path: str) -> List[Tuple[str, bool]]:
+        """Returns (name, is_dir) pairs for the children of the directory at path.
+
+        Equivalent to calling isdir on every name returned by listdir.
+        """
+        return [
+            (name, self.isdir(posixpath.join(path, name)))
+            for name in self.listdir(path)
+        ]
+
     @abc.abstractmethod
     def makedir(self, path: str):
         """Creates a new directory at the given path.
@@ -3,13 +3,16 @@
 """In-memory mock file system library."""
 
 import collections
-import dataclasses
 import functools
+import hashlib
 import posixpath
-from typing import Callable, Dict, Iterable, List, Set, Union
+import sys
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 from file_system import FileSystem
 from file_system import FileSystemEvent
+from file_system import FileSystemEventType
+from file_system import FileSystemObjType
 
 
 class _NotFoundException(Exception):
@@ -27,35 +30,86 @@ class _IsFileException(Exception):
         super().__init__(f"{path} is a file")
 
 
-@dataclasses.dataclass
 class _Directory:
-    children: Set[str] = dataclasses.field(default_factory=set)
+    __slots__ = ("children", "_sorted_children")
+
+    def __init__(self):
+        # Dict used as an insertion-ordered set of child names. Names are interned,
+        # so equal names in different directories share one string object.
+        self.children: Dict[str, None] = {}
+        self._sorted_children: Optional[Tuple[str, ...]] = None
+
+    def add_child(self, name: str):
+        self.children[name] = None
+        self._sorted_children = None
+
+    def remove_child(self, name: str):
+        del self.children[name]
+        self._sorted_children = None
+
+    def sorted_children(self) -> Tuple[str, ...]:
+        if self._sorted_children is None:
+            self._sorted_children = tuple(sorted(self.children))
+        return self._sorted_children
+
+    def copy(self) -> "_Directory":
+        directory = _Directory()
+        directory.children = self.children.copy()
+        directory._sorted_children = self._sorted_children
+        return directory
+
+    def __eq__(self, other):
+        if not isinstance(other, _Directory):
+            return NotImplemented
+        return self.children == other.children
+
+    def __repr__(self):
+        return f"_Directory(children={self.children!r})"
 
 
-@dataclasses.dataclass
 class _File:
-    content: str
+    __slots__ = ("content",)
+
+    def __init__(self, content: str):
+        self.content = content
+
+    def copy(self) -> "_File":
+        return _File(self.content)
+
+    def __eq__(self, other):
+        if not isinstance(other, _File):
+            return NotImplemented
+        return self.content == other.content
+
+    def __repr__(self):
+        return f"_File(content={self.content!r})"
 
 
 _FileSystemObj = Union[_Directory, _File]
 
 
-# pylint: disable=protected-access
-def _count_operation(f):
-    @functools.wraps(f)
-    def wrapper(self, *args, **kwargs):
-        self._operation_counts[f.__name__] += 1
-        return f(self, *args, **kwargs)
+@functools.lru_cache(maxsize=4096)
+def _norm(path: str) -> str:
+    # Interned so that keys stored in and looked up from the object and watch
+    # maps are the same string objects and compare by identity.
+    return sys.intern(posixpath.normpath(path))
 
-    return wrapper
 
+_dirname = functools.lru_cache(maxsize=8192)(posixpath.dirname)
+_basename = functools.lru_cache(maxsize=8192)(posixpath.basename)
+_join = functools.lru_cache(maxsize=8192)(posixpath.join)
 
-def _normpath(f):
-    @functools.wraps(f)
-    def wrapper(self, path, *args, **kwargs):
-        return f(self, posixpath.normpath(path), *args, **kwargs)
 
-    return wrapper
+def _canon(tag: bytes, value: str) -> bytes:
+    """Returns an unambiguous, length-prefixed byte encoding of a tagged string."""
+    data = value.encode()
+    return tag + len(data).to_bytes(8, "little") + data
+
+
+_TREE_BRANCH_MID = "|-- "
+_TREE_BRANCH_LAST = "`-- "
+_TREE_CONT_MID = "|   "
+_TREE_CONT_LAST = "    "
 
 
 class FileSystemImpl(FileSystem):
@@ -65,139 +119,196 @@ class FileSystemImpl(FileSystem):
         self._objs: Dict[str, _FileSystemObj] = {"/": _Directory()}
         self._watch_map: Dict[str, Callable[[FileSystemEvent], None]] = {}
         self._operation_counts: Dict[str, int] = collections.defaultdict(int)
+        # Same as get_num_operations("writefile"), as a plain attribute for callers
+        # that poll it often.
+        self.writefile_count = 0
+        # Memoized subtree_hash digests. If a path has no entry, none of its
+        # ancestors do either.
+        self._hash_cache: Dict[str, bytes] = {}
 
-    @_normpath
-    @_count_operation
     def exists(self, path: str) -> bool:
         """Returns whether the path exists."""
+        path = _norm(path)
+        self._operation_counts["exists"] += 1
         return path in self._objs
 
-    @_normpath
-    @_count_operation
+    def stat(self, path: str) -> Optional[FileSystemObjType]:
+        """Returns the type of the object at the path, or None if it does not exist."""
+        path = _norm(path)
+        self._operation_counts["stat"] += 1
+        obj = self._objs.get(path)
+        if obj is None:
+            return None
+        if isinstance(obj, _Directory):
+            return FileSystemObjType.DIRECTORY
+        return FileSystemObjType.FILE
+
     def isfile(self, path: str) -> bool:
         """Returns whether the path is a file."""
-        if path not in self._objs:
+        path = _norm(path)
+        self._operation_counts["isfile"] += 1
+        obj = self._objs.get(path)
+        if obj is None:
             raise _NotFoundException(path)
-        return isinstance(self._objs[path], _File)
+        return isinstance(obj, _File)
 
-    @_normpath
-    @_count_operation
     def readfile(self, path: str) -> str:
         """Returns the content of the file at the given path."""
-        if path not in self._objs:
-            raise _NotFoundException(path)
+        path = _norm(path)
+        self._operation_counts["readfile"] += 1
         obj = self._objs.get(path)
+        if obj is None:
+            raise _NotFoundException(path)
         if isinstance(obj, _Directory):
             raise _IsDirectoryException(path)
         return obj.content
 
-    @_normpath
-    @_count_operation
     def writefile(self, path: str, content: str):
         """Writes the given content to the file at the given path.
 
         This will create the file if it does not exist or overwrite it if it does.
         """
-        parent_dir = posixpath.dirname(path)
-        if parent_dir not in self._objs:
+        path = _norm(path)
+        self._operation_counts["writefile"] += 1
+        self.writefile_count += 1
+        parent_dir = _dirname(path)
+        parent = self._objs.get(parent_dir)
+        if parent is None:
             raise _NotFoundException(parent_dir)
-        if isinstance(self._objs[parent_dir], _File):
+        if isinstance(parent, _File):
             raise _IsFileException(parent_dir)
-        if path in self._objs and isinstance(self._objs[path], _Directory):
+        if isinstance(self._objs.get(path), _Directory):
             raise _IsDirectoryException(path)
-        filename = posixpath.basename(path)
-        self._objs[parent_dir].children.add(filename)
+        filename = sys.intern(_basename(path))
+        parent.add_child(filename)
         self._objs[path] = _File(content)
+        self._invalidate_hash(path)
 
-    @_normpath
-    @_count_operation
     def removefile(self, path: str):
         """Removes the file at the given path."""
-        if path not in self._objs:
+        path = _norm(path)
+        self._operation_counts["removefile"] += 1
+        obj = self._objs.get(path)
+        if obj is None:
             raise _NotFoundException(path)
-        if isinstance(self._objs[path], _Directory):
+        if isinstance(obj, _Directory):
             raise _IsDirectoryException(path)
-        parent_dir = posixpath.dirname(path)
-        filename = posixpath.basename(path)
-        self._objs[parent_dir].children.remove(filename)
+        parent_dir = _dirname(path)
+        filename = _basename(path)
+        self._objs[parent_dir].remove_child(filename)
         del self._objs[path]
+        self._invalidate_hash(path)
 
-    @_normpath
-    @_count_operation
     def isdir(self, path: str) -> bool:
         """Returns whether the path is a directory."""
-        if path not in self._objs:
+        path = _norm(path)
+        self._operation_counts["isdir"] += 1
+        obj = self._objs.get(path)
+        if obj is None:
             raise _NotFoundException(path)
-        return isinstance(self._objs[path], _Directory)
+        return isinstance(obj, _Directory)
 
-    @_normpath
-    @_count_operation
     def listdir(self, path: str) -> Iterable[str]:
         """Returns the names of children of the directory at the given path.
 
         Note that the returned names are the base names, not the full paths.
         """
-        if path not in self._objs:
+        path = _norm(path)
+        self._operation_counts["listdir"] += 1
+        obj = self._objs.get(path)
+        if obj is None:
             raise _NotFoundException(path)
-        if isinstance(self._objs[path], _File):
+        if isinstance(obj, _File):
             raise _IsFileException(path)
-        return self._objs[path].children.copy()
+        return tuple(obj.children)
+
+    def listdir_types(self, path: str) -> List[Tuple[str, bool]]:
+        """Returns (name, is_dir) pairs for the children of the directory at path.
+
+        Equivalent to calling isdir on every name returned by listdir.
+        """
+        path = _norm(path)
+        self._operation_counts["listdir_types"] += 1
+        obj = self._objs.get(path)
+        if obj is None:
+            raise _NotFoundException(path)
+        if isinstance(obj, _File):
+            raise _IsFileException(path)
+        objs = self._objs
+        return [
+            (name, isinstance(objs[_join(path, name)], _Directory))
+            for name in obj.children
+        ]
 
-    @_normpath
-    @_count_operation
     def makedir(self, path: str):
         """Creates a new directory at the given path.
 
         Does nothing if the directory already exists.
         """
-        parent_dir = posixpath.dirname(path)
-        if parent_dir not in self._objs:
+        path = _norm(path)
+        self._operation_counts["makedir"] += 1
+        self._makedir_norm(path)
+
+    def _makedir_norm(self, path: str):
+        """Implementation of makedir for an already normalized path."""
+        parent_dir = _dirname(path)
+        parent = self._objs.get(parent_dir)
+        if parent is None:
             raise _NotFoundException(parent_dir)
-        if isinstance(self._objs[parent_dir], _File):
+        if isinstance(parent, _File):
             raise _IsFileException(parent_dir)
-        if path in self._objs and isinstance(self._objs[path], _File):
+        obj = self._objs.get(path)
+        if isinstance(obj, _File):
             raise _IsFileException(path)
-        if path in self._objs and isinstance(self._objs[path], _Directory):
+        if isinstance(obj, _Directory):
             return
-        dirname = posixpath.basename(path)
-        self._objs[parent_dir].children.add(dirname)
+        dirname = sys.intern(_basename(path))
+        parent.add_child(dirname)
         self._objs[path] = _Directory()
+        self._invalidate_hash(path)
 
-    @_normpath
-    @_count_operation
     def makedirs(self, path: str):
         """Creates a new directory at the given path.
 
         This will create all necessary parent directories.
         """
-        parent_dir = posixpath.dirname(path)
-        if parent_dir != "/":
-            self.makedirs(parent_dir)
-        self.makedir(path)
+        path = _norm(path)
+        self._operation_counts["makedirs"] += 1
+        parts = path.split("/")
+        for idx in range(2, len(parts) + 1):
+            self._makedir_norm(sys.intern("/".join(parts[:idx])))
 
-    @_normpath
-    @_count_operation
     def removedir(self, path: str):
         """Removes the directory at the given path.
 
         This will also recursively remove all contained files and directories.
         """
-        if path not in self._objs:
+        path = _norm(path)
+        self._operation_counts["removedir"] += 1
+        obj = self._objs.get(path)
+        if obj is None:
             raise _NotFoundException(path)
-        if isinstance(self._objs[path], _File):
+        if isinstance(obj, _File):
             raise _IsFileException(path)
-        for child in self.listdir(path):
-            child_path = posixpath.join(path, child)
-            if isinstance(self._objs[child_path], _File):
-                self.removefile(child_path)
-            else:
-                self.removedir(child_path)
-        parent_dir = posixpath.dirname(path)
-        dir_name = posixpath.basename(path)
-        self._objs[parent_dir].children.remove(dir_name)
-        del self._objs[path]
+        removed_paths = []
+        stack = [path]
+        while stack:
+            dir_path = stack.pop()
+            removed_paths.append(dir_path)
+            for child in self._objs[dir_path].children:
+                child_path = _join(dir_path, child)
+                if isinstance(self._objs[child_path], _Directory):
+                    stack.append(child_path)
+                else:
+                    removed_paths.append(child_path)
+        parent_dir = _dirname(path)
+        dir_name = _basename(path)
+        self._objs[parent_dir].remove_child(dir_name)
+        self._invalidate_hash(parent_dir)
+        for removed_path in removed_paths:
+            self._hash_cache.pop(removed_path, None)
+            del self._objs[removed_path]
 
-    @_normpath
     def watchdir(self, path: str, callback: Callable[[FileSystemEvent], None]):
         """Registers a callback for changes to the directory at the given path.
 
@@ -206,11 +317,12 @@ class FileSystemImpl(FileSystem):
         - An immediate child file or subdirectory is removed.
         - An immmediate child file is modified.
         """
+        path = _norm(path)
         self._watch_map[path] = callback
 
-    @_normpath
     def unwatchdir(self, path: str):
         """Unregisters the callback for changes to the directory at the given path."""
+        path = _norm(path)
         if path not in self._watch_map:
             raise _NotFoundException(path)
         del self._watch_map[path]
@@ -223,57 +335,236 @@ class FileSystemImpl(FileSystem):
         """Returns the number of times the given operation has been called."""
         return self._operation_counts[operation_name]
 
+    def clone(self) -> "FileSystemImpl":
+        """Returns an independent copy of the file system contents.
+
+        Watch callbacks and operation counts are not copied.
+        """
+        fs = FileSystemImpl()
+        fs._objs = {path: obj.copy() for path, obj in self._objs.items()}
+        fs._hash_cache = self._hash_cache.copy()
+        return fs
+
+    def merge_from(self, other: "FileSystemImpl"):
+        """Copies all files and directories of another file system into this one.
+
+        Directories present in both are merged and files present in both are
+        overwritten with the other file system's content.
+        """
+        for path, obj in other._objs.items():
+            existing = self._objs.get(path)
+            if isinstance(existing, _Directory) and isinstance(obj, _Directory):
+                continue
+            if isinstance(existing, _Directory):
+                raise _IsDirectoryException(path)
+            if isinstance(existing, _File) and isinstance(obj, _Directory):
+                raise _IsFileException(path)
+            # Parents precede their children in the object map, so the parent
+            # directory already exists here.
+            self._objs[_dirname(path)].add_child(sys.intern(_basename(path)))
+            self._objs[path] = obj.copy()
+            self._invalidate_hash(path)
+
+    def apply_tree(self, path: str, tree: Dict[str, Any]):
+        """Creates the directory at the given path and populates it from a tree.
+
+        The tree is a nested dict mapping names to either a dict (a subdirectory)
+        or a string (file content). Parent directories are created as needed.
+        """
+        path = _norm(path)
+        self.makedirs(path)
+        stack = [(path, tree)]
+        while stack:
+            dir_path, subtree = stack.pop()
+            directory = self._objs[dir_path]
+            for name, value in subtree.items():
+                child_path = sys.intern(_join(dir_path, name))
+                obj = self._objs.get(child_path)
+                if isinstance(value, dict):
+                    if isinstance(obj, _File):
+                        raise _IsFileException(child_path)
+                    if obj is None:
+                        directory.add_child(sys.intern(name))
+                        self._objs[child_path] = _Directory()
+                        self._invalidate_hash(child_path)
+                    stack.append((child_path, value))
+                else:
+                    if isinstance(obj, _Directory):
+                        raise _IsDirectoryException(child_path)
+                    directory.add_child(sys.intern(name))
+                    self._objs[child_path] = _File(value)
+                    self._invalidate_hash(child_path)
+
+    def subtree_hash(self, path: str) -> bytes:
+        """Returns a digest of the contents of the tree rooted at the given path.
+
+        Two trees have the same digest when they have the same structure and
+        file contents, regardless of the name of the root. Digests are memoized
+        and only recomputed for subtrees modified since the last call.
+        """
+        path = _norm(path)
+        if path not in self._objs:
+            raise _NotFoundException(path)
+        return self._subtree_hash(path)
+
+    def _subtree_hash(self, path: str) -> bytes:
+        digest = self._hash_cache.get(path)
+        if digest is not None:
+            return digest
+        obj = self._objs[path]
+        if isinstance(obj, _File):
+            payload = _canon(b"F", obj.content)
+        else:
+            children = obj.sorted_children()
+            payload = b"".join(
+                [_canon(b"D", str(len(children)))]
+                + [
+                    _canon(b"N", child) + self._subtree_hash(_join(path, child))
+                    for child in children
+                ]
+            )
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        self._hash_cache[path] = digest
+        return digest
+
+    def _invalidate_hash(self, path: str):
+        """Drops the memoized digests of the path and all of its ancestors."""
+        self._hash_cache.pop(path, None)
+        while path != "/":
+            path = _dirname(path)
+            if self._hash_cache.pop(path, None) is None:
+                break
+
     def get_dir_objs(self, path: str) -> Dict[str, _FileSystemObj]:
         """Get a map from relative path to file system objects within a directory.
 
         The relative path will be relative to the given directory path.
         """
-        return {
-            posixpath.relpath(obj_path, path): obj
-            for obj_path, obj in self._objs.items()
-            if obj_path.startswith(path)
-        }
+        path = _norm(path)
+        root = self._objs.get(path)
+        if root is None:
+            return {}
+        dir_objs = {".": root}
+        queue = collections.deque()
+        if isinstance(root, _Directory):
+            queue.append((path, ""))
+        while queue:
+            dir_path, rel_dir = queue.popleft()
+            for child in self._objs[dir_path].children:
+                child_path = _join(dir_path, child)
+                child_rel = f"{rel_dir}/{child}" if rel_dir else child
+                obj = self._objs[child_path]
+                dir_objs[child_rel] = obj
+                if isinstance(obj, _Directory):
+                    queue.append((child_path, child_rel))
+        return dir_objs
+
+    def get_flat(self, path: str) -> Tuple[Tuple[Tuple[str, ...], Optional[str]], ...]:
+        """Returns the tree rooted at the given path as a flat sorted tuple.
+
+        Each entry is a (relative path components, content) pair, where content
+        is None for directories. Entries are in lexicographic order, so two trees
+        with the same structure and file contents give equal tuples.
+        """
+        path = _norm(path)
+        root = self._objs.get(path)
+        if root is None:
+            raise _NotFoundException(path)
+        if isinstance(root, _File):
+            return (((), root.content),)
+        flat = []
+        stack = [(path, ())]
+        while stack:
+            obj_path, rel_parts = stack.pop()
+            obj = self._objs[obj_path]
+            if isinstance(obj, _File):
+                flat.append((rel_parts, obj.content))
+                continue
+            if rel_parts:
+                flat.append((rel_parts, None))
+            # Push in reverse so children are visited in sorted order.
+            for child in reversed(obj.sorted_children()):
+                stack.append((_join(obj_path, child), rel_parts + (child,)))
+        return tuple(flat)
 
     def handle_event(self, event: FileSystemEvent):
         """Trigger watch callback for the given event.
 
         Does nothing if there is no watch callback for the parent directory.
         """
-        parent_dir = posixpath.dirname(event.path)
+        parent_dir = _dirname(event.path)
         if parent_dir in self._watch_map:
             self._watch_map[parent_dir](event)
 
+    def handle_events(self, events: Iterable[FileSystemEvent]):
+        """Trigger watch callbacks for the given events, in order."""
+        for event in events:
+            self.handle_event(event)
+
+    def mutate(self, op: str, path: str, content: Optional[str] = None):
+        """Performs one mutation and fires exactly one event for it at path.
+
+        This is a test convenience for steps that change a single path; steps
+        that make several mutations or report a different path must call the
+        mutation methods and handle_event themselves.
+
+        op is one of "writefile", "makedir", "removefile" or "removedir";
+        content is only used by "writefile". Writing a new file emits an added
+        event and overwriting an existing one emits a modified event.
+        """
+        path = _norm(path)
+        if op == "writefile":
+            if content is None:
+                raise ValueError("writefile requires content")
+            existed = path in self._objs
+            self.writefile(path, content)
+            if existed:
+                event_type = FileSystemEventType.FILE_MODIFIED
+            else:
+                event_type = FileSystemEventType.FILE_OR_SUBDIR_ADDED
+        elif op == "makedir":
+            self.makedir(path)
+            event_type = FileSystemEventType.FILE_OR_SUBDIR_ADDED
+        elif op == "removefile":
+            self.removefile(path)
+            event_type = FileSystemEventType.FILE_OR_SUBDIR_REMOVED
+        elif op == "removedir":
+            self.removedir(path)
+            event_type = FileSystemEventType.FILE_OR_SUBDIR_REMOVED
+        else:
+            raise ValueError(f"Unknown mutation: {op}")
+        self.handle_event(FileSystemEvent(path, event_type))
+
     def debug_string(self, path: str) -> str:
         """Returns a string representation of the path in the file system."""
         if path not in self._objs:
             raise _NotFoundException(path)
 
-        def helper(_path: str) -> List[str]:
-            if _path not in self._objs:
-                raise _NotFoundException(_path)
-            basename = posixpath.basename(_path)
-            if isinstance(self._objs[_path], _File):
-                return [f"{basename}: {self._objs[_path].content}"]
-            lines = [f"{path}" if _path == path else f"/{basename}"]
-            children = self._objs[_path].children
-            for child_idx, child in enumerate(sorted(children)):
-                child_lines = helper(posixpath.join(_path, child))
-                for child_line_idx, child_line in enumerate(child_lines):
-                    prefix = ""
-                    if child_idx == len(children) - 1 and child_line_idx == 0:
-                        prefix += "`"
-                    elif child_idx != len(children) - 1:
-                        prefix += "|"
-                    else:
-                        prefix += " "
-                    if child_line_idx == 0:
-                        prefix += "--"
-                    else:
-                        prefix += "  "
-                    lines.append(f"{prefix} {child_line}")
-            return lines
-
-        return "\n".join(helper(path))
+        lines = []
+        # Entries are (path, indent inherited from ancestors, own branch marker).
+        stack = [(path, "", "")]
+        while stack:
+            _path, indent, branch = stack.pop()
+            obj = self._objs[_path]
+            basename = _basename(_path)
+            if isinstance(obj, _File):
+                lines.append(f"{indent}{branch}{basename}: {obj.content}")
+                continue
+            label = path if _path == path else f"/{basename}"
+            lines.append(f"{indent}{branch}{label}")
+            if branch == _TREE_BRANCH_LAST:
+                indent += _TREE_CONT_LAST
+            elif branch:
+                indent += _TREE_CONT_MID
+            children = obj.sorted_children()
+            last_idx = len(children) - 1
+            for child_idx in range(last_idx, -1, -1):
+                child_path = _join(_path, children[child_idx])
+                if child_idx == last_idx:
+                    stack.append((child_path, indent, _TREE_BRANCH_LAST))
+                else:
+                    stack.append((child_path, indent, _TREE_BRANCH_MID))
+        return "\n".join(lines)
 
     def __str__(self):
         return str(dict(sorted(self._objs.items())))
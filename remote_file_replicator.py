@@ -1,62 +1,153 @@
+import contextlib
+import functools
 import posixpath
-from typing import Any, Callable
+from typing import Any, Callable, Dict, List, Optional, Set
 
-from file_system import FileSystem, FileSystemEvent, FileSystemEventType
+from file_system import FileSystem, FileSystemEvent, FileSystemEventType, FileSystemObjType
 
 # If you're completing this task in an online assessment, you can increment this
 # constant to enable more unit tests relevant to the task you are on (1-5).
 TASK_NUM = 5
 
+_dirname = functools.lru_cache(maxsize=4096)(posixpath.dirname)
+_join = functools.lru_cache(maxsize=4096)(posixpath.join)
+_relpath = functools.lru_cache(maxsize=4096)(posixpath.relpath)
+
+
+def _is_descendant(path: str, parent: str) -> bool:
+    """Returns whether path is parent itself or lies below it.
+
+    Unlike a bare startswith check, /foo2 is not treated as below /foo.
+    """
+    if not path.startswith(parent):
+        return False
+    return len(path) == len(parent) or parent.endswith('/') or path[len(parent)] == '/'
+
+
+def _coalesce_requests(requests: List[Any]) -> List[Any]:
+    """Drops FILE_MODIFIED requests superseded by a later one for the same path."""
+    coalesced = []
+    modified_later = set()
+    for request in reversed(requests):
+        relative_path = request['relative_path']
+        if request['event_type'] == FileSystemEventType.FILE_MODIFIED:
+            if relative_path in modified_later:
+                continue
+            modified_later.add(relative_path)
+        else:
+            modified_later.discard(relative_path)
+        coalesced.append(request)
+    coalesced.reverse()
+    return coalesced
+
 class ReplicatorSource:
     """Class representing the source side of a file replicator."""
 
     def __init__(self, fs: FileSystem, dir_path: str, rpc_handle: Callable[[Any], Any]):
         self._fs = fs
-        self._dir_path = dir_path
+        self._dir_path = posixpath.normpath(dir_path)
         self._rpc_handle = rpc_handle
+        # Map from each watched directory to its watched subdirectories.
+        self._watched: Dict[str, Set[str]] = {}
+        # Requests buffered while inside coalesce_events().
+        self._pending: Optional[List[Any]] = None
 
         # Start watching the directory for changes
-        self._fs.watchdir(dir_path, self.handle_event)
-        self.addwatchdir(self._fs,dir_path)
-        self.sendChildEvents(self._fs,dir_path, 'INIT')
-        self._rpc_handle({'event_type': 'DELETE', 'relative_path': ''})
+        self.watch(self._dir_path)
+        self.addwatchdir(self._fs,self._dir_path)
+        # Send the whole initial sync, including the final cleanup of stale
+        # target entries, as a single batched RPC.
+        requests = list(self.iterChildEvents(self._fs, self._dir_path, 'INIT'))
+        requests.append({'event_type': 'DELETE', 'relative_path': ''})
+        self._rpc_handle({'event_type': 'BATCH', 'requests': requests})
     
     def addwatchdir(self,fs: FileSystem, dir_path: str):
-        for child_name in fs.listdir(dir_path):
-            child_source_path = posixpath.join(dir_path, child_name)
-            if fs.isdir(child_source_path):
-                self._fs.watchdir(child_source_path, self.handle_event)
+        for child_name, is_dir in fs.listdir_types(dir_path):
+            child_source_path = _join(dir_path, child_name)
+            if is_dir:
+                self.watch(child_source_path)
                 self.addwatchdir(fs, child_source_path)
 
+    def watch(self, dir_path: str):
+        self._fs.watchdir(dir_path, self.handle_event)
+        self._watched.setdefault(dir_path, set())
+        parent_path = _dirname(dir_path)
+        if parent_path in self._watched:
+            self._watched[parent_path].add(dir_path)
+
     def unwatch(self, dir_path: str):
-        for key in list(self._fs._watch_map.keys()):
-            if key == dir_path or  key.startswith(dir_path):
-                self._fs.unwatchdir(key)
+        if dir_path not in self._watched:
+            return
+        parent_path = _dirname(dir_path)
+        if parent_path in self._watched:
+            self._watched[parent_path].discard(dir_path)
+        stack = [dir_path]
+        while stack:
+            watched_path = stack.pop()
+            stack.extend(self._watched.pop(watched_path))
+            self._fs.unwatchdir(watched_path)
                 
-    def sendChildEvents(self, fs: FileSystem, dir_path: str, event_type):
-        for child_name in fs.listdir(dir_path):
-            child_source_path = posixpath.join(dir_path, child_name)
-            if fs.isdir(child_source_path):
-                request = {
-                    'event_type': event_type,
-                    'relative_path':  posixpath.relpath(child_source_path, self._dir_path),
-                    'is_dir': True,
-                }
-                self._rpc_handle(request)
-                self.sendChildEvents(fs, child_source_path,event_type)
-            else:
-                request = {
-                    'event_type': event_type,
-                    'relative_path':  posixpath.relpath(child_source_path, self._dir_path),
-                    'is_dir': False,
-                    'file_content': self._fs.readfile(child_source_path)
-                }
-                self._rpc_handle(request)
-            
-            
+    @contextlib.contextmanager
+    def coalesce_events(self):
+        """Buffers the requests for events handled inside the block.
+
+        On exit they are sent to the target as a single batched RPC, with
+        repeated modifications of the same file collapsed into the last one.
+        """
+        if self._pending is not None:
+            yield
+            return
+        self._pending = []
+        try:
+            yield
+        finally:
+            requests = _coalesce_requests(self._pending)
+            self._pending = None
+            if requests:
+                self._rpc_handle({'event_type': 'BATCH', 'requests': requests})
+
+    def send_request(self, request: Any):
+        if self._pending is None:
+            self._rpc_handle(request)
+        elif request['event_type'] == 'BATCH':
+            self._pending.extend(request['requests'])
+        else:
+            self._pending.append(request)
 
+    def iterChildEvents(self, fs: FileSystem, dir_path: str, event_type, rel_prefix: str = ''):
+        """Yields requests for every file and directory below dir_path.
 
-            
+        rel_prefix is the path of dir_path relative to the replicated directory.
+        A directory's request is always yielded before those of its children.
+        """
+        stack = [(dir_path, rel_prefix)]
+        while stack:
+            cur_path, cur_rel = stack.pop()
+            for child_name, is_dir in fs.listdir_types(cur_path):
+                child_source_path = _join(cur_path, child_name)
+                child_rel = f'{cur_rel}/{child_name}' if cur_rel else child_name
+                if is_dir:
+                    stack.append((child_source_path, child_rel))
+                    yield {
+                        'event_type': event_type,
+                        'relative_path':  child_rel,
+                        'is_dir': True,
+                    }
+                else:
+                    yield {
+                        'event_type': event_type,
+                        'relative_path':  child_rel,
+                        'is_dir': False,
+                        'file_content': fs.readfile(child_source_path)
+                    }
+
+    def relative_path(self, path: str) -> str:
+        """Returns path relative to the replicated directory."""
+        if path != self._dir_path and _is_descendant(path, self._dir_path):
+            if self._dir_path.endswith('/'):
+                return path[len(self._dir_path):]
+            return path[len(self._dir_path) + 1:]
+        return _relpath(path, self._dir_path)
 
     def handle_event(self, event: FileSystemEvent):
         """Handle a file system event.
@@ -64,6 +155,7 @@ class ReplicatorSource:
         Used as the callback provided to FileSystem.watchdir().
         """
         #print(event)
+        relative_path = self.relative_path(event.path)
         if event.event_type == FileSystemEventType.FILE_OR_SUBDIR_REMOVED:
             try:
                 self.unwatch(event.path)
@@ -72,34 +164,37 @@ class ReplicatorSource:
             finally:
                 request = {
                     'event_type': event.event_type,
-                    'relative_path':  posixpath.relpath(event.path, self._dir_path)
+                    'relative_path':  relative_path
                 }
         elif  event.event_type == FileSystemEventType.FILE_OR_SUBDIR_ADDED:
             if self._fs.isdir(event.path):
-                self._fs.watchdir(event.path, self.handle_event)
+                self.watch(event.path)
                 self.addwatchdir(self._fs,event.path)
-                self.sendChildEvents(self._fs, event.path, event.event_type)
-                request = {
+                # Ship the new directory and its whole subtree in one RPC.
+                requests = [{
                     'event_type': event.event_type,
-                    'relative_path':  posixpath.relpath(event.path, self._dir_path),
+                    'relative_path':  relative_path,
                     'is_dir': True
-                }
+                }]
+                requests.extend(
+                    self.iterChildEvents(self._fs, event.path, event.event_type, relative_path))
+                request = {'event_type': 'BATCH', 'requests': requests}
             else :
                 request = {
                     'event_type': event.event_type,
-                    'relative_path':  posixpath.relpath(event.path, self._dir_path),
+                    'relative_path':  relative_path,
                     'is_dir': False,
                     'file_content': self._fs.readfile(event.path)
                 }
         else:
             request = {
                 'event_type': event.event_type,
-                'relative_path':  posixpath.relpath(event.path, self._dir_path),
+                'relative_path':  relative_path,
                 'is_dir': False,
                 'file_content': self._fs.readfile(event.path)
             }
         # Send the request to the target through the RPC handle
-        self._rpc_handle(request)
+        self.send_request(request)
 
 class ReplicatorTarget:
     """Class representing the target side of a file replicator."""
@@ -107,23 +202,31 @@ class ReplicatorTarget:
     def __init__(self, fs: FileSystem, dir_path: str):
         self._fs = fs
         self._dir_path = dir_path
-        self._file_paths = []
-        self._dir_paths = []
+        self._file_paths: Set[str] = set()
+        self._dir_paths: Set[str] = set()
         self.dir_file_paths(fs, dir_path)
+        self._dispatch: Dict[Any, Callable[[Any], None]] = {
+            'BATCH': self._on_batch,
+            'INIT': self._on_init,
+            'DELETE': self._on_delete,
+            FileSystemEventType.FILE_OR_SUBDIR_ADDED: self._on_added,
+            FileSystemEventType.FILE_OR_SUBDIR_REMOVED: self._on_removed,
+            FileSystemEventType.FILE_MODIFIED: self._on_modified,
+        }
     
     def dir_file_paths(self, fs: FileSystem, dir_path: str):
-        for child_name in fs.listdir(dir_path):
-            child_source_path = posixpath.join(dir_path, child_name)
-            if fs.isdir(child_source_path):
-                self._dir_paths.append(child_source_path)
+        for child_name, is_dir in fs.listdir_types(dir_path):
+            child_source_path = _join(dir_path, child_name)
+            if is_dir:
+                self._dir_paths.add(child_source_path)
                 self.dir_file_paths(fs, child_source_path)
             else:
-                self._file_paths.append(child_source_path)
+                self._file_paths.add(child_source_path)
 
     def delete_internal(self, fs: FileSystem, directory_path: str):
-        for filename in fs.listdir(directory_path):
-            file_path = posixpath.join(directory_path, filename)
-            if fs.isfile(file_path):
+        for filename, is_dir in fs.listdir_types(directory_path):
+            file_path = _join(directory_path, filename)
+            if not is_dir:
                 if file_path in self._file_paths:
                     fs.removefile(file_path)
             else:
@@ -133,55 +236,62 @@ class ReplicatorTarget:
 
     def handle_request(self, request: Any) -> Any:
         """Handle a request from the ReplicatorSource."""
+        handler = self._dispatch.get(request['event_type'])
+        if handler is not None:
+            handler(request)
+        return {'status': 'success'}
 
-        event_type = request['event_type']
-        relative_path = request['relative_path']
+    def _on_batch(self, request: Any):
+        dispatch = self._dispatch
+        for sub_request in request['requests']:
+            # Unknown request types are ignored, as in handle_request().
+            handler = dispatch.get(sub_request['event_type'])
+            if handler is not None:
+                handler(sub_request)
+
+    def _on_added(self, request: Any):
+        target_path = _join(self._dir_path, request['relative_path'])
+        if request['is_dir']:
+            self._fs.makedirs(target_path)
+        else:
+            self._fs.writefile(target_path, request['file_content'])
+
+    def _on_removed(self, request: Any):
+        target_path = _join(self._dir_path, request['relative_path'])
+        obj_type = self._fs.stat(target_path)
+        if obj_type == FileSystemObjType.DIRECTORY:
+            self._fs.removedir(target_path)
+        elif obj_type == FileSystemObjType.FILE:
+            self._fs.removefile(target_path)
+
+    def _on_modified(self, request: Any):
+        target_path = _join(self._dir_path, request['relative_path'])
+        self._fs.writefile(target_path, request['file_content'])
 
-        if event_type == FileSystemEventType.FILE_OR_SUBDIR_ADDED:
-            target_path = posixpath.join(self._dir_path, relative_path)
+    def _on_init(self, request: Any):
+        target_path = _join(self._dir_path, request['relative_path'])
+        obj_type = self._fs.stat(target_path)
+        if obj_type is None:
             if request['is_dir']:
                 self._fs.makedirs(target_path)
             else:
                 self._fs.writefile(target_path, request['file_content'])
-
-        elif event_type == FileSystemEventType.FILE_OR_SUBDIR_REMOVED:
-            target_path = posixpath.join(self._dir_path, relative_path)
-            if self._fs.exists(target_path):
-                if self._fs.isdir(target_path):
-                    self._fs.removedir(target_path)
-                else:
-                    self._fs.removefile(target_path)
-
-        elif event_type == FileSystemEventType.FILE_MODIFIED:
-            target_path = posixpath.join(self._dir_path, relative_path)
-            self._fs.writefile(target_path, request['file_content'])
-        
-        elif event_type == 'INIT':
-            target_path = posixpath.join(self._dir_path, relative_path)
-            if not self._fs.exists(target_path):
-                if request['is_dir']:
-                    self._fs.makedirs(target_path)
-                else:
+        elif obj_type == FileSystemObjType.DIRECTORY:
+            if(request['is_dir']):
+                self._dir_paths.remove(target_path)
+            else:
+                self._dir_paths.remove(target_path)
+                self._fs.removedir(target_path)
+                self._fs.writefile(target_path, request['file_content'])
+        else:
+            if(request['is_dir']):
+                self._file_paths.remove(target_path)
+                self._fs.removefile(target_path)
+                self._fs.makedir(target_path)
+            else:
+                self._file_paths.remove(target_path)
+                if(request['file_content'] != self._fs.readfile(target_path)):
                     self._fs.writefile(target_path, request['file_content'])
 
-            else:
-                if self._fs.isdir(target_path):
-                    if(request['is_dir']):
-                        self._dir_paths.remove(target_path)
-                    else:
-                        self._dir_paths.remove(target_path)
-                        self._fs.removedir(target_path)
-                        self._fs.writefile(target_path, request['file_content'])
-                else:
-                    if(request['is_dir']):
-                        self._file_paths.remove(target_path)
-                        self._fs.removefile(target_path)
-                        self._fs.makedir(target_path)
-                    else:
-                        self._file_paths.remove(target_path)
-                        if(request['file_content'] != self._fs.readfile(target_path)):
-                            self._fs.writefile(target_path, request['file_content'])
-                           
-        elif event_type == 'DELETE':
-            self.delete_internal(self._fs, self._dir_path)
-        return {'status': 'success'}
\ No newline at end of file
+    def _on_delete(self, request: Any):
+        self.delete_internal(self._fs, self._dir_path)
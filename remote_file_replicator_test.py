@@ -4,11 +4,13 @@
 
 import dataclasses
 import functools
+import marshal
 import os
 import pickle
-from typing import Sequence
+from typing import Any, Callable, List, Tuple
 import unittest
 
+from file_system import _DATACLASS_SLOTS
 from file_system import FileSystem
 from file_system import FileSystemEvent
 from file_system import FileSystemEventType
@@ -31,22 +33,79 @@ except ImportError:
     from remote_file_replicator import TASK_NUM  # type: ignore
 
 
+def _pickle_roundtrip(obj):
+    # Use the newest protocol the running interpreter supports.
+    return pickle.loads(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+# marshal only handles builtin types, so event types are encoded as tagged
+# tuples. Every tuple in the payload is tagged as well, which keeps a payload's
+# own tuples from being mistaken for encoded event types.
+_MARSHAL_EVENT_TYPE = 0
+_MARSHAL_TUPLE = 1
+
+
+def _to_marshallable(obj):
+    if isinstance(obj, FileSystemEventType):
+        return (_MARSHAL_EVENT_TYPE, obj.value)
+    if isinstance(obj, tuple):
+        return (_MARSHAL_TUPLE, tuple(_to_marshallable(value) for value in obj))
+    if isinstance(obj, dict):
+        return {
+            _to_marshallable(key): _to_marshallable(value)
+            for key, value in obj.items()
+        }
+    if isinstance(obj, list):
+        return [_to_marshallable(value) for value in obj]
+    return obj
+
+
+def _from_marshallable(obj):
+    if isinstance(obj, tuple):
+        tag, value = obj
+        if tag == _MARSHAL_EVENT_TYPE:
+            return FileSystemEventType(value)
+        return tuple(_from_marshallable(item) for item in value)
+    if isinstance(obj, dict):
+        return {
+            _from_marshallable(key): _from_marshallable(value)
+            for key, value in obj.items()
+        }
+    if isinstance(obj, list):
+        return [_from_marshallable(value) for value in obj]
+    return obj
+
+
+def _marshal_roundtrip(obj):
+    return _from_marshallable(marshal.loads(marshal.dumps(_to_marshallable(obj))))
+
+
 def pickle_wrapper(f):
-    """A decorator that checks that the request and response are picklable."""
+    """A decorator that checks that the request and response are picklable.
+
+    The check is skipped when the REPLICATOR_SKIP_PICKLE_CHECK environment
+    variable is set to "1", e.g. for benchmarking runs. Setting the
+    REPLICATOR_SERIALIZER environment variable to "marshal" round-trips through
+    marshal instead, which is faster but only supports builtin types.
+    """
+    if os.environ.get("REPLICATOR_SKIP_PICKLE_CHECK") == "1":
+        return f
+    if os.environ.get("REPLICATOR_SERIALIZER") == "marshal":
+        roundtrip = _marshal_roundtrip
+    else:
+        roundtrip = _pickle_roundtrip
 
     @functools.wraps(f)
     def wrapper(request):
-        pickled_request = pickle.dumps(request)
-        unpickled_request = pickle.loads(pickled_request)
+        unpickled_request = roundtrip(request)
         response = f(unpickled_request)
-        pickled_response = pickle.dumps(response)
-        unpickled_response = pickle.loads(pickled_response)
+        unpickled_response = roundtrip(response)
         return unpickled_response
 
     return wrapper
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True, **_DATACLASS_SLOTS)
 class FileSystemDir:
     """Dataclass representing a directory in the file system."""
 
@@ -54,24 +113,41 @@ class FileSystemDir:
     path: str
 
 
-def file_system_dirs_equal(fs_dirs: Sequence[FileSystemDir]) -> bool:
+def file_system_dirs_equal(*fs_dirs: FileSystemDir) -> bool:
     """Checks that all the provided file system directory contents are equal."""
-    if len(fs_dirs) == 0:
+    if len(fs_dirs) <= 1:
         return True
-    ref_dir_objs = fs_dirs[0].fs.get_dir_objs(fs_dirs[0].path)
-    equal = all(
-        fs_dir.fs.get_dir_objs(fs_dir.path) == ref_dir_objs for fs_dir in fs_dirs
+    ref_hash = fs_dirs[0].fs.subtree_hash(fs_dirs[0].path)
+    return all(
+        fs_dir.fs.subtree_hash(fs_dir.path) == ref_hash for fs_dir in fs_dirs[1:]
     )
-    if not equal:
-        print("File system directory contents are not equal!")
-        for idx, fs_dir in enumerate(fs_dirs):
-            if idx > 0:
-                print("-" * 80)
-            print(fs_dir.fs.debug_string(fs_dir.path))
-    return equal
 
 
-@dataclasses.dataclass
+class _DirsDebugMessage:
+    """Assertion message that renders the directory trees only when displayed."""
+
+    def __init__(self, fs_dirs: Tuple[FileSystemDir, ...]):
+        self._fs_dirs = fs_dirs
+
+    def __str__(self):
+        separator = "\n" + "-" * 80 + "\n"
+        lines = ["File system directory contents are not equal!"]
+        ref_dir = self._fs_dirs[0]
+        ref_flat = set(ref_dir.fs.get_flat(ref_dir.path))
+        # Entries are labelled by position since the compared directories may
+        # share a path on different file systems.
+        for idx, fs_dir in enumerate(self._fs_dirs[1:], start=1):
+            flat = set(fs_dir.fs.get_flat(fs_dir.path))
+            for rel_parts, content in sorted(ref_flat ^ flat, key=lambda e: e[0]):
+                side = "dirs[0]" if (rel_parts, content) in ref_flat else f"dirs[{idx}]"
+                lines.append(f"only in {side}: {'/'.join(rel_parts)} = {content!r}")
+        return "\n".join(lines) + "\n" + separator.join(
+            f"dirs[{idx}]: {fs_dir.fs.debug_string(fs_dir.path)}"
+            for idx, fs_dir in enumerate(self._fs_dirs)
+        )
+
+
+@dataclasses.dataclass(frozen=True, **_DATACLASS_SLOTS)
 class Config:
     """Test configuration representing different cases to test for."""
 
@@ -82,6 +158,11 @@ class Config:
     avoid_redundant_writes: bool = False
 
 
+_ADDED = FileSystemEventType.FILE_OR_SUBDIR_ADDED
+_MOD = FileSystemEventType.FILE_MODIFIED
+
+
+@functools.lru_cache(maxsize=None)
 def _in_assessment_environment() -> bool:
     # Only the online assessment environment has pytest.
     return "PYTEST_CURRENT_TEST" in os.environ
@@ -90,6 +171,80 @@ def _in_assessment_environment() -> bool:
 class TestRemoteFileReplicator(unittest.TestCase):
     """Test class for the remote file replicator."""
 
+    @classmethod
+    def setUpClass(cls):
+        # Create source file system.
+        # /base
+        # |-- /sub_1
+        # |   |-- /sub_1_1
+        # |   |-- /sub_1_2
+        # |   |   `-- file_1_2_1
+        # |   |-- file_1_1
+        # |   |-- file_1_2
+        # |   `-- file_1_3
+        # |-- /sub_2
+        # |-- file_1
+        # `-- file_2
+        cls._source_fs_template = FileSystemImpl()
+        cls._source_fs_template.apply_tree(
+            "/base",
+            {
+                "sub_1": {
+                    "sub_1_1": {},
+                    "sub_1_2": {"file_1_2_1": "content_1_2_1"},
+                    "file_1_1": "content_1_1",
+                    "file_1_2": "content_1_2",
+                    "file_1_3": "content_1_3",
+                },
+                "sub_2": {},
+                "file_1": "content_1",
+                "file_2": "content_2",
+            },
+        )
+
+        # Create target file systems. Note that these should get immediately
+        # overwritten by the source file system when the replicators are created.
+        # /other
+        # |-- /dir                    (only populated in the non-empty template)
+        # |   |-- /sub_1              (exists in source)
+        # |   |   |-- /sub_1_1        (exists in source)
+        # |   |   |   `-- file_1_1_1  (does not exist in source)
+        # |   |   |-- /file_1_1       (is a file in source)
+        # |   |   |-- sub_1_2         (is a directory in source)
+        # |   |   |-- file_1_2        (same content as source)
+        # |   |   |-- file_1_3        (different content from source)
+        # |   |   `-- file_1_4        (does not exist in source)
+        # |   |-- /sub_3              (does not exist in source)
+        # |   |   |-- /sub_3_1        (does not exist in source)
+        # |   |   |   `-- file_3_1_1  (does not exist in source)
+        # |   |   `-- file_3_2        (does not exist in source)
+        # |   |-- file_1              (different content from source)
+        # |   |-- file_2              (same content as source)
+        # |   `-- file_3              (does not exist in source)
+        cls._empty_target_fs_template = FileSystemImpl()
+        cls._empty_target_fs_template.makedirs("/other/dir")
+        cls._non_empty_target_fs_template = cls._empty_target_fs_template.clone()
+        cls._non_empty_target_fs_template.apply_tree(
+            "/other/dir",
+            {
+                "sub_1": {
+                    "sub_1_1": {"file_1_1_1": "content_1_1_1"},
+                    "file_1_1": {},
+                    "sub_1_2": "content_1_2",
+                    "file_1_2": "content_1_2",
+                    "file_1_3": "content_not_1_3",
+                    "file_1_4": "content_1_4",
+                },
+                "sub_3": {
+                    "sub_3_1": {"file_3_1_1": "content_3_1_1"},
+                    "file_3_2": "content_3_2",
+                },
+                "file_1": "content_not_1",
+                "file_2": "content_2",
+                "file_3": "content_3",
+            },
+        )
+
     def test_initial_sync(self):
         """Test for initial sync with empty target directory."""
         # Config(unrelated_dirs=False, watch_dirs=False, unwatch_dirs=False, non_empty_target_dir=False, avoid_redundant_writes=False)
@@ -134,84 +289,120 @@ class TestRemoteFileReplicator(unittest.TestCase):
             )
         )
 
-    def _check_min_task_num(self, min_task_num: int):
-        if _in_assessment_environment() and TASK_NUM < min_task_num:
-            self.fail(f"Please set TASK_NUM >= {min_task_num} to run this test.")
-
-    # pylint: disable=too-many-statements
-    def _test_helper(self, config: Config):
-        # Create source file system.
-        # /base
-        # |-- /sub_1
-        # |   |-- /sub_1_1
-        # |   |-- /sub_1_2
-        # |   |   `-- file_1_2_1
-        # |   |-- file_1_1
-        # |   |-- file_1_2
-        # |   `-- file_1_3
-        # |-- /sub_2
-        # |-- file_1
-        # `-- file_2
+    def test_coalesce_events(self):
+        """Test for sending coalesced events as a single RPC."""
         source_fs = FileSystemImpl()
-        source_fs.makedir("/base")
-        source_fs.makedir("/base/sub_1")
-        source_fs.makedir("/base/sub_1/sub_1_1")
-        source_fs.makedir("/base/sub_1/sub_1_2")
-        source_fs.writefile("/base/sub_1/sub_1_2/file_1_2_1", "content_1_2_1")
-        source_fs.writefile("/base/sub_1/file_1_1", "content_1_1")
-        source_fs.writefile("/base/sub_1/file_1_2", "content_1_2")
-        source_fs.writefile("/base/sub_1/file_1_3", "content_1_3")
-        source_fs.makedir("/base/sub_2")
+        source_fs.makedirs("/base/sub_1")
         source_fs.writefile("/base/file_1", "content_1")
-        source_fs.writefile("/base/file_2", "content_2")
+        target_fs = FileSystemImpl()
+        target_fs.makedir("/other")
 
+        source, requests = self._make_recording_replicator(source_fs, target_fs)
+        initial_num_requests = len(requests)
+        initial_num_writes = target_fs.writefile_count
 
-        # Create target file system. Note that this should get immediately overwritten
-        # by the source file system when the replicators are created.
-        # /other
-        # |-- /dir                    (only populated if config.non_empty_target_dir)
-        # |   |-- /sub_1              (exists in source)
-        # |   |   |-- /sub_1_1        (exists in source)
-        # |   |   |   `-- file_1_1_1  (does not exist in source)
-        # |   |   |-- /file_1_1       (is a file in source)
-        # |   |   |-- sub_1_2         (is a directory in source)
-        # |   |   |-- file_1_2        (same content as source)
-        # |   |   |-- file_1_3        (different content from source)
-        # |   |   `-- file_1_4        (does not exist in source)
-        # |   |-- /sub_3              (does not exist in source)
-        # |   |   |-- /sub_3_1        (does not exist in source)
-        # |   |   |   `-- file_3_1_1  (does not exist in source)
-        # |   |   `-- file_3_2        (does not exist in source)
-        # |   |-- file_1              (different content from source)
-        # |   |-- file_2              (same content as source)
-        # |   `-- file_3              (does not exist in source)
+        source_fs.writefile("/base/file_1", "content_1_v2")
+        source_fs.writefile("/base/file_1", "content_1_v3")
+        source_fs.writefile("/base/sub_1/file_1_1", "content_1_1")
+        with source.coalesce_events():
+            source_fs.handle_events(
+                [
+                    FileSystemEvent("/base/file_1", _MOD),
+                    FileSystemEvent("/base/file_1", _MOD),
+                    FileSystemEvent("/base/sub_1/file_1_1", _ADDED),
+                ]
+            )
+
+        self.assertEqual(1, len(requests) - initial_num_requests)
+        self.assertEqual(2, target_fs.writefile_count - initial_num_writes)
+        self._assert_dirs_equal(
+            FileSystemDir(source_fs, "/base"), FileSystemDir(target_fs, "/other")
+        )
+
+    def test_add_populated_subdir(self):
+        """Test for sending an added populated subdirectory as a single RPC."""
+        source_fs = FileSystemImpl()
+        source_fs.makedir("/base")
         target_fs = FileSystemImpl()
         target_fs.makedir("/other")
-        target_fs.makedir("/other/dir")
 
-        # Populate target file system if configured.
+        _, requests = self._make_recording_replicator(source_fs, target_fs)
+        initial_num_requests = len(requests)
+
+        source_fs.apply_tree(
+            "/base/sub_1",
+            {
+                "sub_1_1": {"file_1_1_1": "content_1_1_1"},
+                "sub_1_2": {},
+                "file_1_1": "content_1_1",
+            },
+        )
+        source_fs.handle_event(FileSystemEvent("/base/sub_1", _ADDED))
+
+        self.assertEqual(1, len(requests) - initial_num_requests)
+        self.assertEqual(4, source_fs.num_watched_dirs())
+        self._assert_dirs_equal(
+            FileSystemDir(source_fs, "/base"), FileSystemDir(target_fs, "/other")
+        )
+
+    def test_marshal_roundtrip(self):
+        """Test that the marshal RPC round-trip preserves requests exactly."""
+        request = {
+            "event_type": "BATCH",
+            "requests": [
+                {"event_type": _ADDED, "relative_path": "sub_1", "is_dir": True},
+                {
+                    "event_type": _MOD,
+                    "relative_path": "sub_1/file_1_1",
+                    "is_dir": False,
+                    "file_content": "content_1_1",
+                },
+                {"event_type": "DELETE", "relative_path": ""},
+            ],
+            # Shaped like an encoded event type, but must come back as a tuple.
+            "extra": (0, 1),
+        }
+        roundtripped = _marshal_roundtrip(request)
+        self.assertEqual(request, roundtripped)
+        self.assertIs(_ADDED, roundtripped["requests"][0]["event_type"])
+        self.assertIs(_MOD, roundtripped["requests"][1]["event_type"])
+
+    def _make_recording_replicator(
+        self, source_fs: FileSystem, target_fs: FileSystem
+    ) -> Tuple[ReplicatorSource, List[Any]]:
+        """Replicates /base to /other, recording every request sent over RPC."""
+        target = ReplicatorTarget(target_fs, "/other")
+        pickle_wrapped_rpc_handle = pickle_wrapper(target.handle_request)
+        requests: List[Any] = []
+
+        def rpc_handle(request):
+            requests.append(request)
+            return pickle_wrapped_rpc_handle(request)
+
+        source = ReplicatorSource(source_fs, "/base", rpc_handle)
+        return source, requests
+
+    def _assert_dirs_equal(self, *fs_dirs: FileSystemDir):
+        self.assertTrue(file_system_dirs_equal(*fs_dirs), _DirsDebugMessage(fs_dirs))
+
+    def _check_min_task_num(self, min_task_num: int):
+        if _in_assessment_environment() and TASK_NUM < min_task_num:
+            self.fail(f"Please set TASK_NUM >= {min_task_num} to run this test.")
+
+    # pylint: disable=too-many-statements
+    def _test_helper(self, config: Config):
+        # Create source and target file systems from the class templates.
+        source_fs = self._source_fs_template.clone()
         if config.non_empty_target_dir:
-            target_fs.makedir("/other/dir/sub_1")
-            target_fs.makedir("/other/dir/sub_1/sub_1_1")
-            target_fs.writefile("/other/dir/sub_1/sub_1_1/file_1_1_1", "content_1_1_1")
-            target_fs.makedir("/other/dir/sub_1/file_1_1")
-            target_fs.writefile("/other/dir/sub_1/sub_1_2", "content_1_2")
-            target_fs.writefile("/other/dir/sub_1/file_1_2", "content_1_2")
-            target_fs.writefile("/other/dir/sub_1/file_1_3", "content_not_1_3")
-            target_fs.writefile("/other/dir/sub_1/file_1_4", "content_1_4")
-            target_fs.makedir("/other/dir/sub_3")
-            target_fs.makedir("/other/dir/sub_3/sub_3_1")
-            target_fs.writefile("/other/dir/sub_3/sub_3_1/file_3_1_1", "content_3_1_1")
-            target_fs.writefile("/other/dir/sub_3/file_3_2", "content_3_2")
-            target_fs.writefile("/other/dir/file_1", "content_not_1")
-            target_fs.writefile("/other/dir/file_2", "content_2")
-            target_fs.writefile("/other/dir/file_3", "content_3")
+            target_fs = self._non_empty_target_fs_template.clone()
+        else:
+            target_fs = self._empty_target_fs_template.clone()
 
         # Create source and target FileSystemDirs to use for comparison.
-        fs_dirs = [
+        fs_dirs = (
             FileSystemDir(source_fs, "/base"),
             FileSystemDir(target_fs, "/other/dir"),
-        ]
+        )
 
         # Create unrelated source and target directories if configured.
         if config.unrelated_dirs:
@@ -223,17 +414,20 @@ class TestRemoteFileReplicator(unittest.TestCase):
             # |-- /sub_2
             # `-- file_1
             ref_source_fs_unrelated = FileSystemImpl()
-            for fs in (source_fs, ref_source_fs_unrelated):
-                fs.makedir("/other")
-                fs.makedir("/other/sub_1")
-                fs.writefile("/other/sub_1/file_1_1", "content_1_1")
-                fs.makedir("/other/sub_2")
-                fs.writefile("/other/file_1", "content_1")
-            ref_source_fs_dirs_unrelated = [
+            ref_source_fs_unrelated.apply_tree(
+                "/other",
+                {
+                    "sub_1": {"file_1_1": "content_1_1"},
+                    "sub_2": {},
+                    "file_1": "content_1",
+                },
+            )
+            source_fs.merge_from(ref_source_fs_unrelated)
+            ref_source_fs_dirs_unrelated = (
                 FileSystemDir(source_fs, "/other"),
                 FileSystemDir(ref_source_fs_unrelated, "/other"),
-            ]
-            self.assertTrue(file_system_dirs_equal(ref_source_fs_dirs_unrelated))
+            )
+            self._assert_dirs_equal(*ref_source_fs_dirs_unrelated)
 
             # Create an unrelated target directory and reference file system for
             # comparison. Check that they are initially equal.
@@ -243,44 +437,59 @@ class TestRemoteFileReplicator(unittest.TestCase):
             # |   `-- file_4_1
             # `-- file_2
             ref_target_fs_unrelated = FileSystemImpl()
-            for fs in (target_fs, ref_target_fs_unrelated):
-                fs.makedir("/another")
-                fs.makedir("/another/sub_3")
-                fs.makedir("/another/sub_4")
-                fs.writefile("/another/sub_4/file_4_1", "content_4_1")
-                fs.writefile("/another/file_2", "content_2")
-            ref_target_fs_dirs_unrelated = [
+            ref_target_fs_unrelated.apply_tree(
+                "/another",
+                {
+                    "sub_3": {},
+                    "sub_4": {"file_4_1": "content_4_1"},
+                    "file_2": "content_2",
+                },
+            )
+            target_fs.merge_from(ref_target_fs_unrelated)
+            ref_target_fs_dirs_unrelated = (
                 FileSystemDir(target_fs, "/another"),
                 FileSystemDir(ref_target_fs_unrelated, "/another"),
-            ]
-            self.assertTrue(file_system_dirs_equal(ref_target_fs_dirs_unrelated))
+            )
+            self._assert_dirs_equal(*ref_target_fs_dirs_unrelated)
 
-        # Helper function to check for various correctness issues.
-        initial_num_writes = target_fs.get_num_operations("writefile")
-        
-        def check_correctness(expected_num_watched_dirs: int, expected_num_writes: int):
-            # Check that the target and source directories are equal.
+        # Helper function to check for various correctness issues. The checks
+        # enabled by the config are selected once here rather than on every call.
+        initial_num_writes = target_fs.writefile_count
+        assert_dirs_equal = self._assert_dirs_equal
+        assert_equal = self.assertEqual
+        checks: List[Callable[[int, int], None]] = []
 
-            # self.assertTrue(file_system_dirs_equal(fs_dirs))
+        # Check that the target and source directories are equal.
+        # self.assertTrue(file_system_dirs_equal(fs_dirs))
 
-            # Check that unrelated directories are not modified.
-            if config.unrelated_dirs:
-                self.assertTrue(file_system_dirs_equal(ref_source_fs_dirs_unrelated))
-                self.assertTrue(file_system_dirs_equal(ref_target_fs_dirs_unrelated))
+        # Check that unrelated directories are not modified.
+        if config.unrelated_dirs:
 
+            def check_unrelated_dirs(_num_watched_dirs: int, _num_writes: int):
+                assert_dirs_equal(*ref_source_fs_dirs_unrelated)
+                assert_dirs_equal(*ref_target_fs_dirs_unrelated)
 
-            # Check that the number of watched directories is correct.
-            if config.watch_dirs and config.unwatch_dirs:
-                self.assertEqual(
-                    expected_num_watched_dirs, source_fs.num_watched_dirs()
-                )
+            checks.append(check_unrelated_dirs)
 
-            # Check that the number of writes is correct.
-            if config.non_empty_target_dir and config.avoid_redundant_writes:
-                self.assertEqual(
-                    expected_num_writes,
-                    target_fs.get_num_operations("writefile") - initial_num_writes,
-                )
+        # Check that the number of watched directories is correct.
+        if config.watch_dirs and config.unwatch_dirs:
+
+            def check_num_watched_dirs(num_watched_dirs: int, _num_writes: int):
+                assert_equal(num_watched_dirs, source_fs.num_watched_dirs())
+
+            checks.append(check_num_watched_dirs)
+
+        # Check that the number of writes is correct.
+        if config.non_empty_target_dir and config.avoid_redundant_writes:
+
+            def check_num_writes(_num_watched_dirs: int, num_writes: int):
+                assert_equal(num_writes, target_fs.writefile_count - initial_num_writes)
+
+            checks.append(check_num_writes)
+
+        def check_correctness(expected_num_watched_dirs: int, expected_num_writes: int):
+            for check in checks:
+                check(expected_num_watched_dirs, expected_num_writes)
 
         # Create replicator target and source and check for correctness.
         target = ReplicatorTarget(target_fs, "/other/dir")
@@ -294,83 +503,37 @@ class TestRemoteFileReplicator(unittest.TestCase):
             return
         
         # Remove file from base directory.
-        source_fs.removefile("/base/file_2")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/file_2",
-                FileSystemEventType.FILE_OR_SUBDIR_REMOVED,
-            )
-        )
+        source_fs.mutate("removefile", "/base/file_2")
 
         check_correctness(5, 4)
 
         # Modify file.
-        source_fs.writefile("/base/sub_1/file_1_2", "content_1_2_v2")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/sub_1/file_1_2",
-                FileSystemEventType.FILE_MODIFIED,
-            )
-        )
+        source_fs.mutate("writefile", "/base/sub_1/file_1_2", "content_1_2_v2")
         check_correctness(5, 5)
 
         # Remove file from subdirectory.
-        source_fs.removefile("/base/sub_1/file_1_2")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/sub_1/file_1_2",
-                FileSystemEventType.FILE_OR_SUBDIR_REMOVED,
-            )
-        )
+        source_fs.mutate("removefile", "/base/sub_1/file_1_2")
         check_correctness(5, 5)
 
         # Remove empty subdirectory.
-        source_fs.removedir("/base/sub_1/sub_1_1")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/sub_1/sub_1_1",
-                FileSystemEventType.FILE_OR_SUBDIR_REMOVED,
-            )
-        )
+        source_fs.mutate("removedir", "/base/sub_1/sub_1_1")
         check_correctness(4, 5)
 
         # Remove non-empty subdirectory.
-        source_fs.removedir("/base/sub_1/sub_1_2")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/sub_1/sub_1_2",
-                FileSystemEventType.FILE_OR_SUBDIR_REMOVED,
-            )
-        )
+        source_fs.mutate("removedir", "/base/sub_1/sub_1_2")
         check_correctness(3, 5)
         
         # Add a file in the base directory.
-        source_fs.writefile("/base/file_3", "content_3")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/file_3",
-                FileSystemEventType.FILE_OR_SUBDIR_ADDED,
-            )
-        )
+        source_fs.mutate("writefile", "/base/file_3", "content_3")
         check_correctness(3, 6)
 
         # Add empty subdirectory.
-        source_fs.makedir("/base/sub_1/sub_1_3")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/sub_1/sub_1_3",
-                FileSystemEventType.FILE_OR_SUBDIR_ADDED,
-            )
-        )
+        source_fs.mutate("makedir", "/base/sub_1/sub_1_3")
         check_correctness(4, 6)
 
         # Add a file in the previously added subdirectory.
-        source_fs.writefile("/base/sub_1/sub_1_3/file_1_3_1", "content_1_3_1")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/sub_1/sub_1_3/file_1_3_1",
-                FileSystemEventType.FILE_OR_SUBDIR_ADDED,
-            )
+        source_fs.mutate(
+            "writefile", "/base/sub_1/sub_1_3/file_1_3_1", "content_1_3_1"
         )
         check_correctness(4, 7)
 
@@ -396,33 +559,17 @@ class TestRemoteFileReplicator(unittest.TestCase):
         check_correctness(7, 10)
 
         # Modify file.
-        source_fs.writefile("/base/sub_3/sub_3_1/file_3_1_1", "content_3_1_1_v2")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/sub_3/sub_3_1/file_3_1_1",
-                FileSystemEventType.FILE_MODIFIED,
-            )
+        source_fs.mutate(
+            "writefile", "/base/sub_3/sub_3_1/file_3_1_1", "content_3_1_1_v2"
         )
         check_correctness(7, 11)
 
         # Remove a deeply nested, previously added subdirectory.
-        source_fs.removedir("/base/sub_3/sub_3_2")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/sub_3/sub_3_2",
-                FileSystemEventType.FILE_OR_SUBDIR_REMOVED,
-            )
-        )
+        source_fs.mutate("removedir", "/base/sub_3/sub_3_2")
         check_correctness(6, 11)
 
         # Remove a subdirectory with subdirectories.
-        source_fs.removedir("/base/sub_1")
-        source_fs.handle_event(
-            FileSystemEvent(
-                "/base/sub_1",
-                FileSystemEventType.FILE_OR_SUBDIR_REMOVED,
-            )
-        )
+        source_fs.mutate("removedir", "/base/sub_1")
         
         check_correctness(4, 11)
 